@@ -3,15 +3,33 @@ Database Schemas for Kids Fashion E-commerce (Bangladesh)
 
 Each Pydantic model represents a collection in your database.
 Model name is converted to lowercase for the collection name.
+
+The order hierarchy is defined as msgspec Structs so incoming order payloads
+can be decoded straight from the request body without a Pydantic round-trip.
 """
 
-from typing import List, Optional, Literal
-from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import Annotated, List, Optional, Literal
+
+import msgspec
+from msgspec import Meta
+from pydantic import BaseModel, ConfigDict, Field
+
+# Shared by the Pydantic models: immutable, drop unknown keys, no extra coercions
+_MODEL_CONFIG = ConfigDict(
+    extra="ignore",
+    frozen=True,
+    arbitrary_types_allowed=False,
+    validate_default=False,
+    str_strip_whitespace=False,
+)
 
 # ----------------------------------------------------------------------------
 # USER (optional minimal for order contact)
 # ----------------------------------------------------------------------------
 class User(BaseModel):
+    model_config = _MODEL_CONFIG
+
     name: str = Field(..., description="Full name")
     email: Optional[str] = Field(None, description="Email address")
     phone: Optional[str] = Field(None, description="Phone number")
@@ -22,6 +40,9 @@ class User(BaseModel):
 # PRODUCT (kids fashion specific)
 # ----------------------------------------------------------------------------
 class Product(BaseModel):
+    model_config = _MODEL_CONFIG
+
+    id: Optional[str] = Field(None, description="URL slug, stored as the document _id")
     title: str = Field(..., description="Product title")
     description: Optional[str] = Field(None, description="Product description")
     price_bdt: float = Field(..., ge=0, description="Price in Bangladeshi Taka")
@@ -37,19 +58,24 @@ class Product(BaseModel):
     age_range: Optional[str] = Field(None, description="Age range like 0-3M, 2-5Y, 6-12Y")
     rating: Optional[float] = Field(0.0, ge=0, le=5, description="Average rating")
 
+class ProductOut(Product):
+    """Product as read back from the database (not a collection of its own)."""
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
 # ----------------------------------------------------------------------------
 # ORDER
 # ----------------------------------------------------------------------------
-class OrderItem(BaseModel):
+class OrderItem(msgspec.Struct, frozen=True):
     product_id: str
     title: str
     price_bdt: float
-    quantity: int = Field(1, ge=1)
+    quantity: Annotated[int, Meta(ge=1)] = 1
     size: Optional[str] = None
     color: Optional[str] = None
     image: Optional[str] = None
 
-class ShippingAddress(BaseModel):
+class ShippingAddress(msgspec.Struct, frozen=True):
     name: str
     phone: str
     address_line: str
@@ -57,16 +83,16 @@ class ShippingAddress(BaseModel):
     area: Optional[str] = None
     notes: Optional[str] = None
 
-class PaymentInfo(BaseModel):
+class PaymentInfo(msgspec.Struct, frozen=True):
     method: Literal["COD", "bKash", "Nagad"] = "COD"
     status: Literal["pending", "paid", "failed"] = "pending"
     transaction_id: Optional[str] = None
 
-class Order(BaseModel):
+class Order(msgspec.Struct, frozen=True):
     items: List[OrderItem]
     shipping: ShippingAddress
     subtotal_bdt: float = 0.0
     delivery_fee_bdt: float = 0.0
     total_bdt: float = 0.0
-    payment: PaymentInfo = PaymentInfo()
+    payment: PaymentInfo = msgspec.field(default_factory=PaymentInfo)
     status: Literal["pending", "processing", "shipped", "delivered", "cancelled"] = "pending"